@@ -0,0 +1,149 @@
+"""Module that fetches current temperatures from the Accuweather RSS feed
+for Accuweather sensors. Responses are cached per location code for a
+short time, connections to the server are kept alive between fetches, and
+simultaneous requests for the same location share a single fetch."""
+
+import time, threading, re
+from datetime import datetime
+from http.client import HTTPConnection, HTTPException
+from urllib.parse import urlencode, urlsplit
+import xml.etree.ElementTree as ET
+
+"""Address of the Accuweather current conditions feed."""
+URL = 'http://rss.accuweather.com/rss/liveweather_rss.asp'
+
+
+class FetchError(Exception):
+    """Exception raised when the feed can't be fetched or understood."""
+    def __init__(self,loccode,reason):
+        self.loccode = loccode
+        self.reason = reason
+    def __str__(self):
+        return "Error fetching Accuweather for '{0}': {1}".format(self.loccode,self.reason)
+
+
+def parsetemperature(chunks):
+    """Returns the temperature from the title of the first item in an RSS
+    document, e.g. 'Currently: Sunny: 43F', given an iterable of chunks of
+    the document. Stops parsing as soon as that title has been seen."""
+    parser = ET.XMLPullParser(events=('start','end'))
+    path = []
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event,element in parser.read_events():
+            if event == 'start':
+                path.append(element.tag)
+            else:
+                if path[1:] == ['channel','item','title']:
+                    match = re.search(r'-?\d+',element.text or '')
+                    if match is None:
+                        raise ValueError('No temperature in {0!r}'.format(element.text))
+                    return float(match.group(0))
+                path.pop()
+    raise ValueError('No item title found')
+
+
+class _Fetch():
+    """A fetch in progress, which other threads wanting the same location
+    can wait on."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Fetcher():
+    """Fetches and caches temperatures by location code. A fetched value is
+    reused for ttl seconds. Connections are kept open and reused, and
+    several threads asking for the same location at once share one fetch.
+    """
+
+    # Bytes to read from the response at a time while parsing
+    CHUNKSIZE = 4096
+
+    def __init__(self,url=URL,ttl=60.0,timeout=10.0):
+        self.url = url
+        self.ttl = ttl
+        self.timeout = timeout
+        self._cache = {}    # loccode -> (monotonic fetch time, datetime, temp)
+        self._inflight = {} # loccode -> _Fetch
+        self._idle = []     # open connections not in use
+        self._lock = threading.Lock()
+
+    def _getconn(self):
+        with self._lock:
+            if len(self._idle) > 0:
+                return self._idle.pop()
+        parts = urlsplit(self.url)
+        return HTTPConnection(parts.hostname,parts.port,timeout=self.timeout)
+
+    def _putconn(self,conn):
+        with self._lock:
+            self._idle.append(conn)
+
+    def _fetch(self,loccode):
+        """Fetch a location over the network. Returns (datetime, temp)."""
+        parts = urlsplit(self.url)
+        target = parts.path + '?' + urlencode({'metric':0,'locCode':loccode})
+        conn = self._getconn()
+        try:
+            conn.request('GET',target)
+            response = conn.getresponse()
+            if response.status != 200:
+                raise FetchError(loccode,'HTTP status {0}'.format(response.status))
+            temp = parsetemperature(iter(lambda: response.read(self.CHUNKSIZE),b''))
+            # Finish the body, unparsed, so the connection can be reused
+            response.read()
+        except FetchError:
+            conn.close()
+            raise
+        except (OSError,HTTPException,ValueError,ET.ParseError) as err:
+            conn.close()
+            raise FetchError(loccode,err)
+        self._putconn(conn)
+        return datetime.now(),temp
+
+    def close(self):
+        """Close every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def cached(self,loccode,maxage=None):
+        """Returns the cached (datetime, temp) for a location if it is no
+        older than maxage seconds (default the ttl), otherwise None. Never
+        touches the network."""
+        if maxage is None:
+            maxage = self.ttl
+        entry = self._cache.get(loccode)
+        if entry is None or time.monotonic() - entry[0] > maxage:
+            return None
+        return entry[1],entry[2]
+
+    def current(self,loccode):
+        """Returns (datetime, temp) for a location, from the cache if it is
+        fresh enough, otherwise by fetching it."""
+        value = self.cached(loccode)
+        if value is not None:
+            return value
+        with self._lock:
+            fetch = self._inflight.get(loccode)
+            owner = fetch is None
+            if owner:
+                fetch = self._inflight[loccode] = _Fetch()
+        if not owner:
+            fetch.done.wait()
+        else:
+            try:
+                fetch.result = self._fetch(loccode)
+                self._cache[loccode] = (time.monotonic(),) + fetch.result
+            except Exception as err:
+                fetch.error = err
+            finally:
+                with self._lock:
+                    del self._inflight[loccode]
+                fetch.done.set()
+        if fetch.error is not None:
+            raise fetch.error
+        return fetch.result
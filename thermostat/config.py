@@ -83,3 +83,14 @@ class Config():
             return [self._TYPECONV[dtype](e.text) for e in elements]
         except:
             raise OptionTypeError(name,dtype)
+
+    def attriblist(self,name):
+        """Returns a list of dicts holding the attributes of every element
+        found by the given name. Useful for options like <readings> whose
+        entries carry their values as attributes instead of text."""
+        elements = self._main.findall(name)
+        if (len(elements)==0) and (self._default is not None):
+            elements = self._default.findall(name)
+        if len(elements)==0:
+            raise OptionNotFound(name)
+        return [dict(e.attrib) for e in elements]
@@ -13,10 +13,10 @@ class Daemon:
     start daemon with start(), stop daemon with stop()."""
 
 	def __init__(self, pidfile, stdin=os.devnull, stdout=os.devnull, stderr=os.devnull): 
-        self.pidfile = pidfile
-        self.stdin = stdin
-        self.stdout = stdout
-        self.stderr = stderr
+		self.pidfile = pidfile
+		self.stdin = stdin
+		self.stdout = stdout
+		self.stderr = stderr
 	
 	def daemonize(self):
 		"""Deamonize class. UNIX double fork mechanism."""
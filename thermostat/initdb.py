@@ -1,7 +1,7 @@
 from thermostat.sensor import Base
 from thermostat.config import Config
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect
 import argparse
 
 def main(cmdline=None):
@@ -29,13 +29,24 @@ def main(cmdline=None):
             existing.append(t)
         else:
             new.append(t)
+    # Indexes added to tables after they were created aren't made by
+    # create_all, so find those separately
+    inspector = inspect(engine)
+    newindexes = []
+    for t in existing:
+        engineindexes = [i['name'] for i in inspector.get_indexes(t)]
+        for i in Base.metadata.tables[t].indexes:
+            if i.name not in engineindexes:
+                newindexes.append(i)
     # Confirm table creations
-    confirmstring = 'Tables in engine: {0}\nTables to create: {1}\n'
-    print(confirmstring.format(','.join(existing),','.join(new)))
-    if len(new) > 0:
+    confirmstring = 'Tables in engine: {0}\nTables to create: {1}\nIndexes to create: {2}\n'
+    print(confirmstring.format(','.join(existing),','.join(new),','.join(i.name for i in newindexes)))
+    if len(new) > 0 or len(newindexes) > 0:
         # Boolean short-circuit: only prompts if not args['yes']
         if args.yes==True or input('Continue? [y/n] ').lower() == 'y':
             Base.metadata.create_all(engine)
+            for i in newindexes:
+                i.create(engine)
             print('Done.')
         else:
             print('Abort.')
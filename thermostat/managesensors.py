@@ -8,6 +8,8 @@ import argparse
 
 from thermostat.sensor import Sensor,SensorGroup,Accuweather,W1Therm
 from thermostat.config import Config
+from thermostat.writer import ReadingWriter
+from thermostat import rollup
 
 Session = sessionmaker()
 
@@ -118,11 +120,26 @@ def readsensor(args):
     print("id={id}, '{name}'".format(id=sensor.id,name=sensor.name))
     print("Time: {dt}".format(dt=reading.time.strftime('%Y-%m-%d %H:%M:%S')))
     print("Value: {v:4.1f}".format(v=reading.value))
-    # If 'save' is set, save the reading
+    # If 'save' is set, save the reading through the same path as the
+    # daemon, so the rollups are kept up to date
     if args.save==True:
-        session.commit()
+        writer = ReadingWriter(session.get_bind())
+        writer.add(sensor.id,reading.time,reading.value)
+        writer.flush()
         print("Saved to database.")
 
+def rebuild_rollups(args):
+    """Rebuild the rollup table from the readings already saved."""
+    session = Session()
+    sensorids = None if args.sensorid is None else [args.sensorid]
+    confirmformat = "Rebuild rollups for: {0}\n"
+    print(confirmformat.format('all sensors' if sensorids is None else 'sensor id={0}'.format(args.sensorid)))
+    if args.yes==True or input("Rebuild rollups? [y/n] ").lower() == 'y':
+        processed = rollup.backfill(session.get_bind(),sensorids)
+        print("Processed {0} readings.".format(processed))
+    else:
+        print("Abort.")
+
 
 def main(cmdline=None):
     """Main entry point."""
@@ -164,6 +181,10 @@ def main(cmdline=None):
     parser_readsensor.add_argument('-s','--save',action='store_true',help='Save the reading to the database')
     parser_readsensor.set_defaults(func=readsensor)
     
+    parser_rollups = main_subparsers.add_parser('rollups',description="Rebuild the minute/hour/day rollups from saved readings",help="Rebuild reading rollups")
+    parser_rollups.add_argument('sensorid',nargs='?',default=None,type=int,help='ID of the sensor to rebuild (blank for all)')
+    parser_rollups.set_defaults(func=rebuild_rollups)
+    
     if cmdline is None:
         args = parser.parse_args()
     else:
@@ -177,6 +198,8 @@ def main(cmdline=None):
     echo = config.option('debug/echosql',Config.BOOL)
     engine = create_engine(cxn,echo=echo)
     Session.configure(bind=engine)
+    Accuweather.fetcher.ttl = config.option('accuweather/ttl',Config.FLOAT)
+    Accuweather.fetcher.timeout = config.option('accuweather/timeout',Config.FLOAT)
     # Check what the command is and call appropriate function
     args.func(args)
     return 0
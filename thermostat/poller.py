@@ -0,0 +1,275 @@
+"""Module containing the polling daemon, which reads every sensor listed in
+the <readings> section of the configuration file on its own schedule and
+saves the readings to the database."""
+
+import sys, os, time, heapq, itertools, signal
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import argparse
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, with_polymorphic
+
+from thermostat.daemon import Daemon
+from thermostat.config import Config, OptionTypeError
+from thermostat.sensor import Sensor, Reading, Accuweather
+from thermostat.writer import ReadingWriter
+from thermostat.spool import Spool, Forwarder
+
+
+class ScheduledRead():
+    """A single entry in the polling schedule: which sensor to read, how
+    many seconds apart its readings should be, and optionally a resolution
+    for sensors that support one. The lead is how long before each deadline
+    the read is started, so slow conversions finish on time."""
+    def __init__(self,sensorid,delay,resolution=None):
+        self.sensorid = sensorid
+        self.delay = delay
+        self.resolution = resolution
+        self.lead = 0
+        self.deadline = None
+
+    def __repr__(self):
+        return "<ScheduledRead({0},{1})>".format(self.sensorid,self.delay)
+
+
+class Schedule():
+    """A deadline-ordered queue of ScheduledRead entries. Kept as a heap so
+    finding the reads that are due stays cheap as sensors are added."""
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __iter__(self):
+        return (e for d,c,e in self._heap)
+
+    def add(self,entry,deadline):
+        """Add an entry with the given (monotonic) deadline. It is due to be
+        dispatched its lead time earlier."""
+        entry.deadline = deadline
+        # The counter breaks ties so entries themselves are never compared
+        heapq.heappush(self._heap,(deadline - entry.lead,next(self._counter),entry))
+
+    def nextdeadline(self):
+        """Returns the time the next entry is due to be dispatched, or None
+        if empty."""
+        if len(self._heap)==0:
+            return None
+        return self._heap[0][0]
+
+    def popdue(self,now):
+        """Remove and return every entry whose deadline has passed."""
+        due = []
+        while len(self._heap)>0 and self._heap[0][0]<=now:
+            due.append(heapq.heappop(self._heap)[2])
+        return due
+
+    def reschedule(self,entry,now):
+        """Put a dispatched entry back on the schedule. Deadlines advance in
+        whole multiples of the delay from the previous deadline rather than
+        from the dispatch time, so lateness does not accumulate. Slots that
+        were missed entirely are skipped rather than run back to back."""
+        deadline = entry.deadline + entry.delay
+        if deadline <= now:
+            deadline += ((now - deadline)//entry.delay + 1)*entry.delay
+        self.add(entry,deadline)
+
+
+def _takereadings(cls,sensors):
+    """Read sensors of one class in a worker thread, returning a dict of
+    sensor id to Reading or exception. The sensors are detached from any
+    session, so each Reading is unlinked from its sensor's 'readings'
+    backref to keep it from accumulating there."""
+    results = cls.readmany(sensors)
+    for r in results.values():
+        if isinstance(r,Reading):
+            r.sensor = None
+    return results
+
+
+def _bulkcapable(cls):
+    """Returns whether a sensor class can read many sensors at once."""
+    return cls.readmany.__func__ is not Sensor.readmany.__func__
+
+
+class Poller(Daemon):
+    """Daemon which reads sensors on the schedule given in the <readings>
+    section of the configuration file. Reads run in a pool of worker threads
+    with a timeout, so one slow sensor cannot hold up the others."""
+
+    # Longest the main loop will sleep before checking whether to stop
+    _MAXSLEEP = 1.0
+
+    def __init__(self,pidfile,config,**kwargs):
+        super().__init__(pidfile,**kwargs)
+        self.config = config
+        self.workers = config.option('poller/workers',Config.INT)
+        self.timeout = config.option('poller/timeout',Config.FLOAT)
+        self.spoolpath = config.option('spool/path')
+        if self.spoolpath is not None:
+            self.spoolpath = os.path.abspath(self.spoolpath)
+        self.readings = []
+        for r in config.attriblist('readings/read'):
+            try:
+                resolution = r.get('resolution')
+                if resolution is not None:
+                    resolution = int(resolution)
+                self.readings.append(ScheduledRead(int(r['sensorid']),float(r['delay']),resolution))
+            except (KeyError,ValueError):
+                raise OptionTypeError('readings/read',Config.FLOAT)
+        self._stopping = False
+
+    def _handle_signal(self,signum,frame):
+        self._stopping = True
+
+    def _loadsensors(self,session):
+        """Load every scheduled sensor, including subclass columns, and
+        detach them so worker threads can read them without a session."""
+        ids = [r.sensorid for r in self.readings]
+        allsensors = with_polymorphic(Sensor,'*')
+        sensors = session.query(allsensors).filter(allsensors.id.in_(ids)).all()
+        session.close()
+        return {s.id:s for s in sensors}
+
+    def _flush(self,force=False):
+        """Write out buffered readings, if due or if forced. A failed write
+        keeps the readings buffered to be tried again."""
+        try:
+            if force:
+                self.writer.flush()
+            else:
+                self.writer.flushdue()
+        except Exception as err:
+            sys.stderr.write('Error saving {0} readings: {1}\n'.format(len(self.writer),err))
+
+    def run(self):
+        signal.signal(signal.SIGTERM,self._handle_signal)
+        signal.signal(signal.SIGINT,self._handle_signal)
+        cxn = self.config.option('connection')
+        echo = self.config.option('debug/echosql',Config.BOOL)
+        self.engine = create_engine(cxn,echo=echo,pool_pre_ping=True)
+        # Readings either go through the local spool, or are batched
+        # straight to the database if no spool is configured
+        if self.spoolpath is None:
+            self.forwarder = None
+            self.writer = ReadingWriter(self.engine,
+                    batchsize=self.config.option('writer/batchsize',Config.INT),
+                    maxdelay=self.config.option('writer/maxdelay',Config.FLOAT))
+        else:
+            self.writer = Spool(self.spoolpath)
+            self.forwarder = Forwarder(self.writer,self.engine,
+                    batchsize=self.config.option('spool/batchsize',Config.INT),
+                    interval=self.config.option('spool/interval',Config.FLOAT))
+            self.forwarder.start()
+        Accuweather.fetcher.ttl = self.config.option('accuweather/ttl',Config.FLOAT)
+        Accuweather.fetcher.timeout = self.config.option('accuweather/timeout',Config.FLOAT)
+        self.sensors = self._loadsensors(sessionmaker(bind=self.engine)())
+        # Build the schedule, with every sensor due immediately
+        self.schedule = Schedule()
+        now = time.monotonic()
+        for r in self.readings:
+            if r.sensorid in self.sensors:
+                sensor = self.sensors[r.sensorid]
+                if r.resolution is not None:
+                    if hasattr(sensor,'resolution'):
+                        sensor.resolution = r.resolution
+                    else:
+                        sys.stderr.write('Sensor {0} has no resolution setting, ignored\n'.format(r.sensorid))
+                r.lead = sensor.readtime()
+                self.schedule.add(r,now + r.lead)
+            else:
+                sys.stderr.write('No sensor found with id={0}, not scheduled\n'.format(r.sensorid))
+        pool = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            self._loop(pool)
+        finally:
+            pool.shutdown(wait=False)
+            self._flush(force=True)
+            if self.forwarder is not None:
+                self.forwarder.stop()
+
+    def _loop(self,pool):
+        """Main loop: dispatch due reads, collect finished ones, and sleep
+        until the next deadline or timeout."""
+        pending = {} # future -> (sensorids, dispatch time)
+        busy = {}    # sensorid -> most recent future, even if timed out
+        while not self._stopping:
+            # Collect finished reads
+            for f in [f for f in pending if f.done()]:
+                sensorids,started = pending.pop(f)
+                try:
+                    results = f.result()
+                except Exception as err:
+                    results = {sid:err for sid in sensorids}
+                for sensorid,reading in results.items():
+                    if isinstance(reading,Exception):
+                        sys.stderr.write('Error reading sensor {0}: {1}\n'.format(sensorid,reading))
+                    else:
+                        self.writer.add(sensorid,reading.time,reading.value)
+            self._flush()
+            # Give up on reads that have run too long
+            now = time.monotonic()
+            for f,(sensorids,started) in list(pending.items()):
+                if now - started > self.timeout:
+                    del pending[f]
+                    for sensorid in sensorids:
+                        sys.stderr.write('Reading sensor {0} timed out\n'.format(sensorid))
+            # Dispatch due reads. A sensor whose previous read is still
+            # running (e.g. timed out but stuck) skips this slot. Sensors
+            # whose class can read many at once (e.g. one 1-wire bulk
+            # conversion) are sent to a single worker together.
+            batches = {}
+            for entry in self.schedule.popdue(now):
+                prev = busy.get(entry.sensorid)
+                if prev is not None and not prev.done():
+                    sys.stderr.write('Sensor {0} still busy, skipping read\n'.format(entry.sensorid))
+                else:
+                    sensor = self.sensors[entry.sensorid]
+                    cls = type(sensor)
+                    key = cls if _bulkcapable(cls) else sensor.id
+                    batches.setdefault(key,(cls,[]))[1].append(sensor)
+                self.schedule.reschedule(entry,now)
+            for cls,sensors in batches.values():
+                f = pool.submit(_takereadings,cls,sensors)
+                pending[f] = ([s.id for s in sensors],now)
+                for s in sensors:
+                    busy[s.id] = f
+            # Sleep until the next deadline, timeout, flush or finished read
+            wakeups = [self.schedule.nextdeadline()]
+            wakeups += [started + self.timeout for s,started in pending.values()]
+            if self.writer.deadline() is not None:
+                wakeups.append(self.writer.deadline())
+            wakeup = min(wakeups)
+            sleep = min(max(wakeup - time.monotonic(),0),self._MAXSLEEP)
+            if len(pending)>0:
+                wait(pending,timeout=sleep,return_when=FIRST_COMPLETED)
+            else:
+                time.sleep(sleep)
+
+
+def main(cmdline=None):
+    """Main entry point."""
+    parser = argparse.ArgumentParser(prog='thermostatd',description='Read sensors on a schedule and save the readings to the database.')
+    parser.add_argument('-c','--config',help='Configuration file path',default='thermostat.conf',dest='configfile',metavar='filename')
+    parser.add_argument('-p','--pidfile',help='PID file path',default='/tmp/thermostatd.pid',metavar='filename')
+    parser.add_argument('command',choices=['start','stop','restart','foreground'],help="Daemon action, or 'foreground' to run without detaching")
+    if cmdline is None:
+        args = parser.parse_args()
+    else:
+        args = parser.parse_args(cmdline)
+
+    # Config is read now, since the daemon changes directory to / on start
+    defaultfile = 'thermostat.conf.defaults'
+    config = Config(args.configfile,defaultfile)
+    poller = Poller(os.path.abspath(args.pidfile),config)
+    if args.command=='start':
+        poller.start()
+    elif args.command=='stop':
+        poller.stop()
+    elif args.command=='restart':
+        poller.restart()
+    else:
+        poller.run()
+    return 0
@@ -0,0 +1,112 @@
+"""Module that maintains the rollup table, which holds the count, sum,
+minimum and maximum of each sensor's readings per minute, hour and day."""
+
+from sqlalchemy import select, and_, case, bindparam
+
+from thermostat.sensor import Rollup, Reading
+
+
+def aggregate(rows,aggs=None):
+    """Aggregates rows (dicts with sensor_id, time and value) into every
+    rollup period. Returns a dict mapping (sensor_id, period, start) to a
+    list of [count, total, minimum, maximum], adding to aggs if given."""
+    if aggs is None:
+        aggs = {}
+    for r in rows:
+        value = r['value']
+        for period in Rollup.PERIODS:
+            key = (r['sensor_id'],period,Rollup.bucketstart(period,r['time']))
+            agg = aggs.get(key)
+            if agg is None:
+                aggs[key] = [1,value,value,value]
+            else:
+                agg[0] += 1
+                agg[1] += value
+                if value < agg[2]:
+                    agg[2] = value
+                if value > agg[3]:
+                    agg[3] = value
+    return aggs
+
+
+def _merge(conn,aggs):
+    """Adds aggregates into the rollup table, updating buckets which already
+    exist and inserting the rest. Takes three statements however many
+    buckets there are."""
+    if len(aggs)==0:
+        return
+    table = Rollup.__table__
+    c = table.c
+    starts = [k[2] for k in aggs]
+    query = select([c.sensor_id,c.period,c.start]).where(and_(
+                c.sensor_id.in_(set(k[0] for k in aggs)),
+                c.start.between(min(starts),max(starts))))
+    existing = set(tuple(row) for row in conn.execute(query))
+    updates,inserts = [],[]
+    for (sensorid,period,start),(count,total,minimum,maximum) in aggs.items():
+        if (sensorid,period,start) in existing:
+            updates.append({'b_sensor_id':sensorid,'b_period':period,'b_start':start,
+                            'b_count':count,'b_total':total,
+                            'b_minimum':minimum,'b_maximum':maximum})
+        else:
+            inserts.append({'sensor_id':sensorid,'period':period,'start':start,
+                            'count':count,'total':total,
+                            'minimum':minimum,'maximum':maximum})
+    if len(updates)>0:
+        update = table.update().where(and_(
+                    c.sensor_id == bindparam('b_sensor_id'),
+                    c.period == bindparam('b_period'),
+                    c.start == bindparam('b_start'))).values(
+                count = c.count + bindparam('b_count'),
+                total = c.total + bindparam('b_total'),
+                minimum = case([(c.minimum < bindparam('b_minimum'),c.minimum)],
+                               else_=bindparam('b_minimum')),
+                maximum = case([(c.maximum > bindparam('b_maximum'),c.maximum)],
+                               else_=bindparam('b_maximum')))
+        conn.execute(update,updates)
+    if len(inserts)>0:
+        conn.execute(table.insert(),inserts)
+
+
+def updaterollups(conn,rows):
+    """Folds newly inserted readings into the rollup table. Should run in
+    the same transaction as the insert so the two can't disagree."""
+    _merge(conn,aggregate(rows))
+
+
+def backfill(engine,sensorids=None,batchsize=10000):
+    """Rebuilds the rollups for the given sensor ids (or all sensors) from
+    the readings already in the database, replacing whatever rollups they
+    had. Readings are streamed in (sensor_id, time) order, so memory use
+    stays bounded by batchsize however long the history is. Should be run
+    while nothing else is writing readings for those sensors. Returns the
+    number of readings processed."""
+    rollup = Rollup.__table__
+    reading = Reading.__table__
+    query = select([reading.c.sensor_id,reading.c.time,reading.c.value]).\
+                order_by(reading.c.sensor_id,reading.c.time)
+    delete = rollup.delete()
+    if sensorids is not None:
+        query = query.where(reading.c.sensor_id.in_(sensorids))
+        delete = delete.where(rollup.c.sensor_id.in_(sensorids))
+    processed = 0
+    with engine.begin() as conn:
+        conn.execute(delete)
+        # Rows arrive sorted, so once a batch is done only the buckets in
+        # the last row's day can still change; the rest are written out
+        aggs = {}
+        result = conn.execution_options(stream_results=True).execute(query)
+        while True:
+            batch = result.fetchmany(batchsize)
+            if len(batch)==0:
+                break
+            aggregate(({'sensor_id':sid,'time':t,'value':v} for sid,t,v in batch),aggs)
+            processed += len(batch)
+            lastid,lasttime,lastvalue = batch[-1]
+            lastday = Rollup.bucketstart(Rollup.DAY,lasttime)
+            done = {k:a for k,a in aggs.items()
+                    if k[0]!=lastid or Rollup.bucketstart(Rollup.DAY,k[2])!=lastday}
+            _merge(conn,done)
+            aggs = {k:a for k,a in aggs.items() if k not in done}
+        _merge(conn,aggs)
+    return processed
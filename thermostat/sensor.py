@@ -1,17 +1,12 @@
-from sqlalchemy import Column, Sequence, ForeignKey
+from sqlalchemy import Column, Sequence, ForeignKey, Index
 from sqlalchemy import Integer, String, DateTime, Float
 from sqlalchemy import desc
-from sqlalchemy.orm import relationship, backref
+from sqlalchemy.orm import relationship, backref, aliased, object_session
 from sqlalchemy.ext.declarative import declarative_base
 
 from datetime import datetime
 
-from urllib.parse import urlencode
-from urllib.request import urlopen
-import xml.etree.ElementTree as ET
-import re
-
-from w1thermsensor.core import W1ThermSensor,NoSensorFoundError,KernelModuleLoadError
+from thermostat import w1, accuweather
 
 """Base class for use in this module."""
 Base = declarative_base()
@@ -32,6 +27,11 @@ class SensorGroup(Base):
     
     def __repr__(self):
         return "<SensorGroup('{0}','{1}')>".format(self.name,self.description)
+    
+    def latest(self):
+        """Returns a dict of the most recent Reading from each sensor in this
+        group, keyed by sensor id."""
+        return latestreadings(object_session(self),groupid=self.id)
 
 class Sensor(Base):
     """Base class of a sensor. Specific sensor types should subclass
@@ -62,11 +62,36 @@ class Sensor(Base):
         """
         raise NotImplementedError()
     
+    def latest(self):
+        """Returns the most recent saved Reading from this sensor, or None.
+        Served by the (sensor_id, time) index on the reading table."""
+        return self.readings.first()
+    
     def read(self):
         """Return a Reading instance representing the current temperature
         from this sensor."""
         raise NotImplementedError()
     
+    def readtime(self):
+        """Returns roughly how many seconds a read of this sensor takes
+        before the value is measured, so the scheduler can start it early.
+        """
+        return 0
+    
+    @classmethod
+    def readmany(cls,sensors):
+        """Read several sensors of this type, returning a dict mapping each
+        sensor's id to its Reading, or to the exception raised reading it.
+        Subclasses whose hardware can read many sensors at once should
+        override this; by default they are read one after another."""
+        results = {}
+        for s in sensors:
+            try:
+                results[s.id] = s.read()
+            except Exception as err:
+                results[s.id] = err
+        return results
+    
 
 class Reading(Base):
     """Defines a temperature reading taken by a sensor at a specific time."""
@@ -77,6 +102,8 @@ class Reading(Base):
     time = Column(DateTime, nullable=False)
     value = Column(Float, nullable=False)
     
+    __table_args__ = (Index('ix_reading_sensor_time','sensor_id','time'),)
+    
     sensor = relationship('Sensor',
                 backref=backref('readings',
                     order_by='desc(Reading.time)',
@@ -94,6 +121,96 @@ class Reading(Base):
             self.value)
 
 
+def latestreadings(session,sensorids=None,groupid=None):
+    """Returns a dict of the most recent Reading for each sensor, keyed by
+    sensor id, in a single query. Optionally limited to a list of sensor ids
+    and/or the sensors in one group. Sensors with no readings are left out.
+    
+    Each sensor's newest reading id is found with a correlated subquery
+    driven from the sensor table, which is one short walk down the
+    (sensor_id, time) index per sensor, so the cost depends on the number
+    of sensors and not the size of the reading table."""
+    newer = aliased(Reading)
+    newest = session.query(newer.id).\
+                filter(newer.sensor_id == Sensor.id).\
+                order_by(newer.time.desc()).\
+                limit(1).correlate(Sensor).as_scalar()
+    ids = session.query(newest).select_from(Sensor)
+    if sensorids is not None:
+        ids = ids.filter(Sensor.id.in_(sensorids))
+    if groupid is not None:
+        ids = ids.filter(Sensor.group_id == groupid)
+    query = session.query(Reading).filter(Reading.id.in_(ids.subquery()))
+    return {r.sensor_id:r for r in query}
+
+
+class Rollup(Base):
+    """Aggregate of one sensor's readings over one time bucket of a minute,
+    an hour or a day. Kept up to date as readings are written (see
+    thermostat.rollup) so trends can be charted without touching the
+    reading table."""
+    __tablename__ = 'rollup'
+    
+    # Bucket lengths, in seconds, from coarsest to finest
+    DAY = 86400
+    HOUR = 3600
+    MINUTE = 60
+    PERIODS = (DAY, HOUR, MINUTE)
+    
+    sensor_id = Column(Integer, ForeignKey('sensor.id'), primary_key=True)
+    period = Column(Integer, primary_key=True)
+    start = Column(DateTime, primary_key=True)
+    count = Column(Integer, nullable=False)
+    total = Column(Float, nullable=False)
+    minimum = Column(Float, nullable=False)
+    maximum = Column(Float, nullable=False)
+    
+    sensor = relationship('Sensor')
+    
+    def __repr__(self):
+        return "<Rollup({0},{1},'{2}',{3:5.1f})>".format(
+            self.sensor_id,
+            self.period,
+            self.start.strftime('%Y-%m-%d %H:%M:%S'),
+            self.mean)
+    
+    @property
+    def mean(self):
+        return self.total/self.count
+    
+    @staticmethod
+    def bucketstart(period,time):
+        """Returns the start of the bucket of the given period which
+        contains the given time."""
+        if period == Rollup.DAY:
+            return time.replace(hour=0,minute=0,second=0,microsecond=0)
+        elif period == Rollup.HOUR:
+            return time.replace(minute=0,second=0,microsecond=0)
+        elif period == Rollup.MINUTE:
+            return time.replace(second=0,microsecond=0)
+        raise ValueError('Unknown rollup period {0}'.format(period))
+
+
+def rollups(session,start,end,resolution,sensorids=None):
+    """Returns Rollup rows covering start to end for each sensor (or only the
+    given sensor ids), ordered by sensor and time. Uses the coarsest period
+    no longer than resolution seconds, so a month at hourly resolution reads
+    about 720 rows per sensor. Resolutions finer than a minute get minute
+    rollups."""
+    period = Rollup.MINUTE
+    for p in Rollup.PERIODS:
+        if p <= resolution:
+            period = p
+            break
+    query = session.query(Rollup).filter(
+                Rollup.period == period,
+                Rollup.start >= Rollup.bucketstart(period,start),
+                Rollup.start < end)
+    if sensorids is not None:
+        query = query.filter(Rollup.sensor_id.in_(sensorids))
+    return query.order_by(Rollup.sensor_id,Rollup.start).all()
+
+
 class Accuweather(Sensor):
     """A sensor class representing an outdoor temperature 
     fetched from Accuweather."""
@@ -107,24 +224,24 @@ class Accuweather(Sensor):
         self.loccode = loccode
         super().__init__(**kwargs)
     
+    """Fetcher shared by all Accuweather sensors, so sensors with the same
+    location code share one cached fetch."""
+    fetcher = accuweather.Fetcher()
+    
     def __repr__(self):
         return "<Accuweather({0})>".format(self.loccode)
     
     def read(self):
-        url='http://rss.accuweather.com/rss/liveweather_rss.asp'
-        data = {'metric':0,'locCode':self.loccode}
-        with urlopen(url+'?'+urlencode(data)) as response:
-            xml = response.read()
-        docroot = ET.fromstring(xml)
-        currentweather = docroot.find('channel').find('item').find('title').text
-        temp = float(re.findall(r'\d+', currentweather)[0])
-        time = datetime.now()
+        time,temp = self.fetcher.current(self.loccode)
         return Reading(time,temp,self)
     
     def available(self):
+        # Any successful fetch within the last hour will do
+        if self.fetcher.cached(self.loccode,maxage=3600) is not None:
+            return True
         try:
-            self.read()
-        except:
+            self.fetcher.current(self.loccode)
+        except accuweather.FetchError:
             return False
         else:
             return True
@@ -133,8 +250,8 @@ class Accuweather(Sensor):
 class W1Therm(Sensor):
     """A sensor class representing a 1-wire temperature sensor,
     e.g. DS18b20 
-    Uses the w1thermsensor package for the heavy lifting.
-    Source: https://github.com/timofurrer/w1thermsensor"""
+    Reads the kernel's sysfs interface directly (see thermostat.w1), and
+    reads many sensors from a single bulk conversion where possible."""
     __tablename__ = 'w1therm'
     __mapper_args__ = {'polymorphic_identity':'w1therm'}
 
@@ -142,6 +259,13 @@ class W1Therm(Sensor):
     w1_type = Column(Integer, nullable=False)
     w1_id = Column(String(16), nullable=False)
     
+    """The bus all W1Therm sensors are read from."""
+    bus = w1.W1Bus()
+    
+    """Resolution in bits (9-12) to set the device to before reading, or
+    None to leave it as it is. Lower resolutions convert much faster."""
+    resolution = None
+    
     def __init__(self,w1_type,w1_id,**kwargs):
         self.w1_type = w1_type
         self.w1_id = w1_id
@@ -153,18 +277,40 @@ class W1Therm(Sensor):
                     self.w1_id)
     
     def available(self):
-        try:
-            wts = W1ThermSensor(sensor_type=self.w1_type,sensor_id=self.w1_id)
-        except NoSensorFoundError:
-            return False
-        except KernelModuleLoadError:
-            return False
-        else:
-            return True
+        return self.bus.exists(self.w1_type,self.w1_id)
+    
+    def readtime(self):
+        if self.resolution is None:
+            return w1.conversiontime(self.bus.resolution(self.w1_type,self.w1_id))
+        return w1.conversiontime(self.resolution)
+    
+    def _applyresolution(self):
+        if self.resolution is not None:
+            self.bus.setresolution(self.w1_type,self.w1_id,self.resolution)
     
     def read(self):
-        wts = W1ThermSensor(sensor_type=self.w1_type,sensor_id=self.w1_id)
-        temp = wts.get_temperature(W1ThermSensor.DEGREES_F)
+        self._applyresolution()
+        temp = self.bus.read(self.w1_type,self.w1_id)*9/5 + 32
         time = datetime.now()
         return Reading(time,temp,self)
-
+    
+    @classmethod
+    def readmany(cls,sensors):
+        results = {}
+        ready = []
+        for s in sensors:
+            try:
+                s._applyresolution()
+            except Exception as err:
+                results[s.id] = err
+            else:
+                ready.append(s)
+        temps = cls.bus.readall([(s.w1_type,s.w1_id) for s in ready])
+        time = datetime.now()
+        for s in ready:
+            temp = temps[(s.w1_type,s.w1_id)]
+            if isinstance(temp,Exception):
+                results[s.id] = temp
+            else:
+                results[s.id] = Reading(time,temp*9/5 + 32,s)
+        return results
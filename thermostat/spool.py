@@ -0,0 +1,130 @@
+"""Module containing the local store-and-forward spool. Readings are first
+written to a small SQLite file on local disk, and a background thread
+forwards them to the main database in large batches. A slow or unreachable
+database then never blocks or loses readings; they wait in the spool and
+catch up in bulk once it's back."""
+
+import sys, threading, sqlite3
+from datetime import datetime
+
+from thermostat.writer import newrows, insertreadings
+
+
+class Spool():
+    """A durable local queue of readings, kept in a WAL-mode SQLite file.
+    Every add() is committed straight away, which with WAL and
+    synchronous=NORMAL does not wait on an fsync, so it stays cheap no
+    matter what the network is doing.
+
+    Provides the same add/deadline/flushdue/flush interface as ReadingWriter
+    so the poller can write to either. Each thread gets its own SQLite
+    connection."""
+
+    _SCHEMA = """CREATE TABLE IF NOT EXISTS spool (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sensor_id INTEGER NOT NULL,
+                    time TEXT NOT NULL,
+                    value REAL NOT NULL)"""
+
+    def __init__(self,path):
+        self.path = path
+        self._local = threading.local()
+        self._connection().execute(self._SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local,'conn',None)
+        if conn is None:
+            conn = sqlite3.connect(self.path,isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def __len__(self):
+        return self._connection().execute('SELECT count(*) FROM spool').fetchone()[0]
+
+    def add(self,sensorid,time,value):
+        """Append a single reading to the spool."""
+        self._connection().execute(
+                'INSERT INTO spool (sensor_id,time,value) VALUES (?,?,?)',
+                (sensorid,time.isoformat(' '),value))
+
+    def deadline(self):
+        """Readings are committed as they're added, so nothing is ever due."""
+        return None
+
+    def flushdue(self,now=None):
+        return 0
+
+    def flush(self):
+        return 0
+
+    def peek(self,limit):
+        """Returns (last sequence number, rows) for up to limit of the oldest
+        readings in the spool, without removing them. Rows are dicts of
+        sensor_id, time and value."""
+        cursor = self._connection().execute(
+                'SELECT seq,sensor_id,time,value FROM spool ORDER BY seq LIMIT ?',
+                (limit,))
+        lastseq, rows = None, []
+        for seq,sensorid,time,value in cursor:
+            lastseq = seq
+            rows.append({'sensor_id':sensorid,
+                         'time':datetime.fromisoformat(time),
+                         'value':value})
+        return lastseq,rows
+
+    def ack(self,lastseq):
+        """Remove every reading up to and including the given sequence
+        number, once they are safely in the main database."""
+        self._connection().execute('DELETE FROM spool WHERE seq <= ?',(lastseq,))
+
+
+class Forwarder(threading.Thread):
+    """Background thread that moves readings from a Spool into the main
+    database in batches of up to batchsize, checking every interval seconds
+    when the spool is empty. Readings are only removed from the spool after
+    the batch commits, and a batch skips any reading already in the database,
+    so replaying after a crash between the two steps is harmless. After a
+    failed batch it waits twice as long each time, up to maxbackoff."""
+
+    def __init__(self,spool,engine,batchsize=1000,interval=5.0,maxbackoff=300.0):
+        super().__init__(name='spool-forwarder',daemon=True)
+        self.spool = spool
+        self.engine = engine
+        self.batchsize = batchsize
+        self.interval = interval
+        self.maxbackoff = maxbackoff
+        self._stopping = threading.Event()
+
+    def forward(self):
+        """Forward a single batch. Returns the number of readings removed
+        from the spool."""
+        lastseq,rows = self.spool.peek(self.batchsize)
+        if len(rows)==0:
+            return 0
+        with self.engine.begin() as conn:
+            insertreadings(conn,newrows(conn,rows))
+        self.spool.ack(lastseq)
+        return len(rows)
+
+    def run(self):
+        wait = self.interval
+        while not self._stopping.is_set():
+            try:
+                forwarded = self.forward()
+            except Exception as err:
+                sys.stderr.write('Error forwarding spooled readings: {0}\n'.format(err))
+                self._stopping.wait(wait)
+                wait = min(wait*2,self.maxbackoff)
+                continue
+            wait = self.interval
+            # Keep going without a pause while catching up
+            if forwarded < self.batchsize:
+                self._stopping.wait(self.interval)
+
+    def stop(self,timeout=None):
+        """Ask the thread to finish and wait for it. Anything left in the
+        spool is forwarded the next time the daemon starts."""
+        self._stopping.set()
+        self.join(timeout)
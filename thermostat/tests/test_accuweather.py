@@ -0,0 +1,107 @@
+"""Test the Accuweather fetcher against a local stand-in HTTP server"""
+
+import threading, time, unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+from thermostat import accuweather
+
+RSS = """<?xml version="1.0" encoding="utf-8"?>
+<rss version="2.0"><channel><title>Weather</title>
+<item><title>Currently: Sunny: {temp}F</title></item>
+<item><title>Forecast: Cloudy</title></item>
+</channel></rss>"""
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.connections.add(self.client_address)
+        time.sleep(server.delay)
+        loccode = parse_qs(urlsplit(self.path).query)['locCode'][0]
+        if loccode not in server.temps:
+            self.send_response(404)
+            self.send_header('Content-Length','0')
+            self.end_headers()
+            return
+        body = RSS.format(temp=server.temps[loccode]).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type','application/rss+xml')
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self,*args):
+        pass
+
+
+class FetcherTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1',0),FeedHandler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.requests = 0
+        self.server.connections = set()
+        self.server.delay = 0
+        self.server.temps = {'12345':43,'99999':-5}
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        url = 'http://127.0.0.1:{0}/rss/liveweather_rss.asp'.format(self.server.server_port)
+        self.fetcher = accuweather.Fetcher(url=url,ttl=60,timeout=5)
+
+    def tearDown(self):
+        self.fetcher.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def test_parse(self):
+        chunks = [RSS.format(temp=71).encode('utf-8')[i:i+7] for i in range(0,300,7)]
+        self.assertEqual(accuweather.parsetemperature(chunks),71.0)
+        with self.assertRaises(ValueError):
+            accuweather.parsetemperature([b'<rss><channel></channel></rss>'])
+
+    def test_fetch_and_cache(self):
+        when,temp = self.fetcher.current('12345')
+        self.assertEqual(temp,43.0)
+        self.assertEqual(self.fetcher.current('12345'),(when,temp))
+        self.assertEqual(self.fetcher.cached('12345'),(when,temp))
+        self.assertIsNone(self.fetcher.cached('99999'))
+        self.assertEqual(self.server.requests,1)
+
+    def test_negative_and_keepalive(self):
+        self.assertEqual(self.fetcher.current('99999')[1],-5.0)
+        self.fetcher.current('12345')
+        self.assertEqual(self.server.requests,2)
+        self.assertEqual(len(self.server.connections),1)
+
+    def test_expired(self):
+        self.fetcher.ttl = 0
+        self.fetcher.current('12345')
+        time.sleep(0.01)
+        self.fetcher.current('12345')
+        self.assertEqual(self.server.requests,2)
+
+    def test_error(self):
+        with self.assertRaises(accuweather.FetchError):
+            self.fetcher.current('00000')
+        # The connection was closed after the error, and a new one works
+        self.assertEqual(self.fetcher.current('12345')[1],43.0)
+
+    def test_coalesce(self):
+        self.server.delay = 0.2
+        results = []
+        def fetch():
+            results.append(self.fetcher.current('12345'))
+        threads = [threading.Thread(target=fetch) for i in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(results),5)
+        self.assertEqual(len(set(results)),1)
+        self.assertEqual(self.server.requests,1)
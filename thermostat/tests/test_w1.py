@@ -0,0 +1,99 @@
+"""Test the sysfs 1-wire driver against a fake /sys/bus/w1/devices tree"""
+
+import os, shutil, tempfile, unittest
+
+from thermostat import w1
+
+
+def slavefile(celsius,crcok=True,corrupt=False):
+    """Build the contents of a w1_slave file for the given temperature."""
+    raw = int(round(celsius*16)) & 0xFFFF
+    scratchpad = [raw & 0xFF, raw >> 8, 0x4b, 0x46, 0x7f, 0xff, 0x0c, 0x10]
+    scratchpad.append(w1.crc8(scratchpad))
+    if corrupt:
+        scratchpad[8] ^= 0xFF
+    hexbytes = ' '.join('{0:02x}'.format(b) for b in scratchpad)
+    return '{0} : crc={1:02x} {2}\n{0} t={3}\n'.format(
+                hexbytes,scratchpad[8],'YES' if crcok else 'NO',int(celsius*1000))
+
+
+class FakeBusTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.bus = w1.W1Bus(self.root)
+        os.mkdir(os.path.join(self.root,'w1_bus_master1'))
+        self.bulkfile = os.path.join(self.root,'w1_bus_master1','therm_bulk_read')
+        with open(self.bulkfile,'w') as f:
+            f.write('0\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def adddevice(self,w1_id,contents,w1_type=0x28):
+        path = os.path.join(self.root,w1.devicename(w1_type,w1_id))
+        os.makedirs(path,exist_ok=True)
+        with open(os.path.join(path,'w1_slave'),'w') as f:
+            f.write(contents)
+
+    def test_devices(self):
+        self.adddevice('0000055f3b2a',slavefile(21.5))
+        self.adddevice('0000055f3b2b',slavefile(19.0))
+        self.assertEqual(sorted(self.bus.devices()),
+                         [(0x28,'0000055f3b2a'),(0x28,'0000055f3b2b')])
+        self.assertTrue(self.bus.exists(0x28,'0000055f3b2a'))
+        self.assertFalse(self.bus.exists(0x28,'0000055f3b2c'))
+
+    def test_read(self):
+        self.adddevice('0000055f3b2a',slavefile(21.5))
+        self.assertAlmostEqual(self.bus.read(0x28,'0000055f3b2a'),21.5)
+
+    def test_read_missing(self):
+        with self.assertRaises(w1.SensorNotFound):
+            self.bus.read(0x28,'0000055f3b2a')
+
+    def test_bad_crc(self):
+        self.adddevice('000000000001',slavefile(21.5,crcok=False))
+        self.adddevice('000000000002',slavefile(21.5,corrupt=True))
+        with self.assertRaises(w1.ReadError):
+            self.bus.read(0x28,'000000000001')
+        with self.assertRaises(w1.ReadError):
+            self.bus.read(0x28,'000000000002')
+
+    def test_readall(self):
+        self.adddevice('000000000001',slavefile(21.5))
+        self.adddevice('000000000002',slavefile(-3.25))
+        self.adddevice('000000000003',slavefile(21.5,crcok=False))
+        devices = [(0x28,'000000000001'),(0x28,'000000000002'),
+                   (0x28,'000000000003'),(0x28,'000000000004')]
+        results = self.bus.readall(devices,retries=1)
+        self.assertAlmostEqual(results[devices[0]],21.5)
+        self.assertAlmostEqual(results[devices[1]],-3.25)
+        self.assertIsInstance(results[devices[2]],w1.ReadError)
+        self.assertIsInstance(results[devices[3]],w1.SensorNotFound)
+        # The bulk conversion was triggered on the bus master
+        with open(self.bulkfile) as f:
+            self.assertEqual(f.read().strip(),'trigger')
+
+    def test_resolution(self):
+        self.adddevice('000000000001',slavefile(21.5))
+        resfile = os.path.join(self.root,w1.devicename(0x28,'000000000001'),'resolution')
+        with open(resfile,'w') as f:
+            f.write('12\n')
+        self.assertEqual(self.bus.resolution(0x28,'000000000001'),12)
+        self.bus.setresolution(0x28,'000000000001',9)
+        with open(resfile) as f:
+            self.assertEqual(f.read().strip(),'9')
+        self.assertEqual(self.bus.resolution(0x28,'000000000001'),9)
+        self.assertAlmostEqual(w1.conversiontime(9),0.09375)
+        with self.assertRaises(ValueError):
+            self.bus.setresolution(0x28,'000000000001',8)
+
+    def test_no_bulk_for_fast_devices(self):
+        # One 9-bit device read alone is quicker than a bulk conversion
+        # that has to wait for a 12-bit device elsewhere on the bus
+        self.adddevice('000000000001',slavefile(21.5))
+        self.adddevice('000000000002',slavefile(22.5))
+        self.bus._resolutions[(0x28,'000000000001')] = 9
+        self.bus.readall([(0x28,'000000000001')])
+        with open(self.bulkfile) as f:
+            self.assertEqual(f.read().strip(),'0')
@@ -0,0 +1,222 @@
+"""Module that reads 1-wire temperature sensors (e.g. DS18B20) straight from
+the kernel's sysfs interface, without going through the w1thermsensor
+package. Where the kernel supports it, one bulk conversion is started on
+every bus at once so that reading all the probes in the house costs about
+one conversion time instead of one per probe."""
+
+import os, re, time
+
+"""Where the kernel exposes 1-wire devices."""
+W1_DEVICES = '/sys/bus/w1/devices'
+
+# Scratchpad temperature the DS18B20 reports before its first conversion
+_POWERON_RAW = (0x50,0x05)
+
+
+class SensorNotFound(Exception):
+    """Exception raised when a 1-wire device is not on the bus."""
+    def __init__(self,w1_type,w1_id):
+        self.w1_type = w1_type
+        self.w1_id = w1_id
+    def __str__(self):
+        return "1-wire device '{0}' not found".format(devicename(self.w1_type,self.w1_id))
+
+
+class ReadError(Exception):
+    """Exception raised when a 1-wire device returns a reading which fails
+    its CRC check or can't be parsed."""
+    def __init__(self,w1_type,w1_id,reason):
+        self.w1_type = w1_type
+        self.w1_id = w1_id
+        self.reason = reason
+    def __str__(self):
+        return "Bad reading from 1-wire device '{0}': {1}".format(
+                    devicename(self.w1_type,self.w1_id),self.reason)
+
+
+def devicename(w1_type,w1_id):
+    """Returns the sysfs directory name of a device, e.g. '28-0000055f3b2a'."""
+    return '{0:02x}-{1}'.format(w1_type,w1_id)
+
+
+def conversiontime(bits):
+    """Returns how long, in seconds, a DS18B20 takes to convert a temperature
+    at the given resolution: about 94 ms at 9 bits doubling up to 750 ms at
+    12 bits."""
+    return 0.75/2**(12-bits)
+
+
+def crc8(data):
+    """Dallas/Maxim 1-wire CRC8 of a sequence of byte values."""
+    crc = 0
+    for byte in data:
+        for i in range(8):
+            mix = (crc ^ byte) & 0x01
+            crc >>= 1
+            if mix:
+                crc ^= 0x8C
+            byte >>= 1
+    return crc
+
+
+def parse(w1_type,w1_id,text):
+    """Parses the contents of a w1_slave file, returning degrees Celsius.
+    The file holds two lines of the nine scratchpad bytes, the first ending
+    with the kernel's CRC verdict and the second with the temperature in
+    thousandths of a degree, e.g.
+
+        72 01 4b 46 7f ff 0e 10 57 : crc=57 YES
+        72 01 4b 46 7f ff 0e 10 57 t=23125
+    """
+    lines = text.strip().splitlines()
+    if len(lines) != 2:
+        raise ReadError(w1_type,w1_id,'expected two lines, got {0}'.format(len(lines)))
+    if not lines[0].strip().endswith('YES'):
+        raise ReadError(w1_type,w1_id,'kernel CRC check failed')
+    try:
+        scratchpad = [int(b,16) for b in lines[0].split(':')[0].split()]
+        match = re.search(r't=(-?\d+)',lines[1])
+        millidegrees = int(match.group(1))
+    except (ValueError,AttributeError):
+        raise ReadError(w1_type,w1_id,'unparseable output')
+    if len(scratchpad) != 9 or crc8(scratchpad[:8]) != scratchpad[8]:
+        raise ReadError(w1_type,w1_id,'scratchpad CRC mismatch')
+    if tuple(scratchpad[:2]) == _POWERON_RAW:
+        raise ReadError(w1_type,w1_id,'no conversion done since power-on')
+    return millidegrees/1000.0
+
+
+class W1Bus():
+    """Access to every 1-wire bus under a sysfs devices directory. The root
+    can be pointed at a fake directory tree for testing."""
+
+    # How often to check whether a bulk conversion has finished, and the
+    # longest to wait for one (a 12-bit DS18B20 takes about 750 ms)
+    POLL = 0.02
+    CONVERSION_TIMEOUT = 1.5
+
+    # Resolution assumed for devices which haven't been set, the DS18B20's
+    # power-on default
+    DEFAULT_RESOLUTION = 12
+
+    def __init__(self,root=W1_DEVICES):
+        self.root = root
+        self._resolutions = {}
+
+    def _path(self,*parts):
+        return os.path.join(self.root,*parts)
+
+    def devices(self):
+        """Returns a list of (w1_type, w1_id) for every device present."""
+        found = []
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return found
+        for name in names:
+            match = re.match(r'^([0-9a-f]{2})-([0-9a-f]{12})$',name)
+            if match is not None:
+                found.append((int(match.group(1),16),match.group(2)))
+        return found
+
+    def exists(self,w1_type,w1_id):
+        """Returns whether the given device is present on the bus."""
+        return os.path.exists(self._path(devicename(w1_type,w1_id),'w1_slave'))
+
+    def resolution(self,w1_type,w1_id):
+        """Returns the resolution in bits a device was last set to, or the
+        default if it hasn't been set through this bus."""
+        return self._resolutions.get((w1_type,w1_id),self.DEFAULT_RESOLUTION)
+
+    def setresolution(self,w1_type,w1_id,bits):
+        """Sets the resolution of a device, in bits from 9 to 12. Does nothing
+        if this bus already set it to that. Newer kernels have a resolution
+        attribute for this; older ones take the number written to w1_slave."""
+        if bits not in (9,10,11,12):
+            raise ValueError('Resolution must be 9 to 12 bits, not {0}'.format(bits))
+        if self._resolutions.get((w1_type,w1_id)) == bits:
+            return
+        path = self._path(devicename(w1_type,w1_id),'resolution')
+        if not os.path.exists(path):
+            path = self._path(devicename(w1_type,w1_id),'w1_slave')
+        try:
+            with open(path,'w') as f:
+                f.write('{0}\n'.format(bits))
+        except (IOError,OSError):
+            raise SensorNotFound(w1_type,w1_id)
+        self._resolutions[(w1_type,w1_id)] = bits
+
+    def _bulkworthwhile(self,devices):
+        """A bulk conversion takes as long as the slowest device on the bus,
+        so it's only worth it if converting the given devices one at a time
+        would take at least as long."""
+        onebyone = sum(conversiontime(self.resolution(*d)) for d in devices)
+        slowest = max([conversiontime(self.resolution(*d)) for d in self.devices()] + [0])
+        return onebyone >= slowest
+
+    def _masters(self):
+        """Returns the bulk-read control files of every bus master that has
+        one. Older kernels don't, and get no bulk conversion."""
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return []
+        paths = [self._path(n,'therm_bulk_read') for n in names if n.startswith('w1_bus_master')]
+        return [p for p in paths if os.path.exists(p)]
+
+    def convertall(self):
+        """Starts a simultaneous temperature conversion on every device of
+        every bus that supports it, and waits for it to finish. Returns
+        whether any bulk conversion was done."""
+        masters = self._masters()
+        for path in masters:
+            with open(path,'w') as f:
+                f.write('trigger\n')
+        # Reading the file gives -1 while any conversion is in progress
+        deadline = time.monotonic() + self.CONVERSION_TIMEOUT
+        for path in masters:
+            while time.monotonic() < deadline:
+                with open(path,'r') as f:
+                    status = f.read().strip()
+                if status != '-1':
+                    break
+                time.sleep(self.POLL)
+        return len(masters) > 0
+
+    def read(self,w1_type,w1_id):
+        """Reads a single device, returning degrees Celsius. Unless a bulk
+        conversion has just been done, the kernel runs a conversion for this
+        device alone first."""
+        path = self._path(devicename(w1_type,w1_id),'w1_slave')
+        try:
+            with open(path,'r') as f:
+                text = f.read()
+        except (IOError,OSError):
+            raise SensorNotFound(w1_type,w1_id)
+        return parse(w1_type,w1_id,text)
+
+    def readall(self,devices,retries=2):
+        """Reads every one of the (w1_type, w1_id) pairs given, after a single
+        bulk conversion unless converting them one at a time would be quicker
+        (e.g. a few 9-bit devices on a bus with 12-bit ones). Devices whose
+        reading fails are retried up to retries more times, individually.
+        Returns a dict mapping each pair to degrees Celsius, or to the
+        exception from its last attempt."""
+        if self._bulkworthwhile(devices):
+            self.convertall()
+        results = {}
+        todo = list(devices)
+        for attempt in range(retries+1):
+            failed = []
+            for dev in todo:
+                try:
+                    results[dev] = self.read(*dev)
+                except SensorNotFound as err:
+                    results[dev] = err
+                except ReadError as err:
+                    results[dev] = err
+                    failed.append(dev)
+            todo = failed
+            if len(todo) == 0:
+                break
+        return results
@@ -0,0 +1,114 @@
+"""Module containing the buffered writer used to save readings to the
+database in batches instead of one ORM object and transaction each."""
+
+import time, threading
+
+from sqlalchemy import select, and_
+
+from thermostat.sensor import Reading
+from thermostat.rollup import updaterollups
+
+
+class ReadingWriter():
+    """Collects readings and writes them to the database as a single
+    executemany insert, bypassing the ORM. A batch is due to be written once
+    it reaches batchsize rows or its oldest row is maxdelay seconds old;
+    flushdue() writes it out if so, and flush() writes it out regardless.
+
+    The writer holds on to the engine it's given, so every batch reuses a
+    connection from that engine's pool. It is safe to add() from several
+    threads."""
+
+    def __init__(self,engine,batchsize=100,maxdelay=30.0):
+        self.engine = engine
+        self.batchsize = batchsize
+        self.maxdelay = maxdelay
+        self._rows = []
+        self._oldest = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self,sensorid,time,value):
+        """Buffer a single reading."""
+        with self._lock:
+            if len(self._rows)==0:
+                self._oldest = _now()
+            self._rows.append({'sensor_id':sensorid,'time':time,'value':value})
+
+    def deadline(self):
+        """Returns the (monotonic) time by which the buffered readings should
+        be written, or None if nothing is buffered."""
+        oldest = self._oldest
+        if oldest is None:
+            return None
+        return oldest + self.maxdelay
+
+    def flushdue(self,now=None):
+        """Write out the buffer if it is full or its oldest reading has waited
+        long enough. Returns the number of readings written."""
+        deadline = self.deadline()
+        if now is None:
+            now = _now()
+        if deadline is None:
+            return 0
+        if len(self._rows) < self.batchsize and deadline > now:
+            return 0
+        return self.flush()
+
+    def flush(self):
+        """Write every buffered reading in one transaction. Returns the
+        number of readings written. If the write fails the readings are put
+        back in the buffer and the exception is raised."""
+        with self._lock:
+            rows, oldest = self._rows, self._oldest
+            self._rows, self._oldest = [], None
+        if len(rows)==0:
+            return 0
+        try:
+            with self.engine.begin() as conn:
+                insertreadings(conn,rows)
+        except:
+            with self._lock:
+                self._rows = rows + self._rows
+                self._oldest = oldest
+            raise
+        return len(rows)
+
+
+def insertreadings(conn,rows):
+    """Insert rows (dicts with sensor_id, time and value) into the reading
+    table as a single executemany, and fold them into the rollups. Every
+    bulk write of readings should go through here."""
+    if len(rows)==0:
+        return
+    conn.execute(Reading.__table__.insert(),rows)
+    updaterollups(conn,rows)
+
+
+def newrows(conn,rows):
+    """Returns the rows (dicts with sensor_id, time and value) which do not
+    already have a reading for the same sensor at the same time. Used to
+    make writes that may be repeated, like replaying a spool, idempotent.
+    Costs one query over the time span covered by the rows."""
+    if len(rows)==0:
+        return rows
+    table = Reading.__table__
+    ids = set(r['sensor_id'] for r in rows)
+    times = [r['time'] for r in rows]
+    query = select([table.c.sensor_id,table.c.time]).where(and_(
+                table.c.sensor_id.in_(ids),
+                table.c.time.between(min(times),max(times))))
+    existing = set((sid,t) for sid,t in conn.execute(query))
+    fresh = []
+    for r in rows:
+        key = (r['sensor_id'],r['time'])
+        if key not in existing:
+            existing.add(key)
+            fresh.append(r)
+    return fresh
+
+
+def _now():
+    return time.monotonic()